@@ -0,0 +1,110 @@
+"""Benchmark de suscripciones: implementación anterior vs upsert atómico y bulk_write
+
+Uso: python benchmark_subscriptions.py [num_usuarios]
+Usa MONGO_URL del .env y bases de datos temporales que se eliminan al terminar.
+La implementación anterior se mide sobre una colección sin el índice único
+de user_id, tal como funcionaba en producción.
+"""
+import asyncio
+import os
+import sys
+import time
+import uuid
+from pathlib import Path
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from notifications import WebPushManager, Subscription
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+COUNTRIES = ['ESP', 'USA', 'GBR', 'FRA', 'DEU', 'ITA', 'MEX', 'ARG']
+RACE_CALLS = 20
+
+def codes(i):
+    return COUNTRIES[:1 + i % len(COUNTRIES)]
+
+async def legacy_subscribe_to_countries(db, user_id, country_codes):
+    """Implementación anterior: find_one + update_one/insert_one"""
+    existing = await db.subscriptions.find_one({"user_id": user_id}, {"_id": 0})
+    if existing:
+        await db.subscriptions.update_one(
+            {"user_id": user_id},
+            {"$set": {"country_codes": country_codes}}
+        )
+        existing['country_codes'] = country_codes
+        return Subscription(**existing)
+    subscription = Subscription(user_id=user_id, country_codes=country_codes)
+    doc = subscription.model_dump()
+    doc['created_at'] = doc['created_at'].isoformat()
+    await db.subscriptions.insert_one(doc)
+    return subscription
+
+async def timed(label, coro_factory, rounds):
+    start = time.perf_counter()
+    for i in range(rounds):
+        await coro_factory(i)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<40} {elapsed * 1000:>9.1f} ms  ({elapsed / rounds * 1000:.2f} ms/op)")
+
+async def count_race_duplicates(subscribe, db):
+    """Lanzar llamadas concurrentes para un mismo usuario y contar documentos creados"""
+    user_id = str(uuid.uuid4())
+    results = await asyncio.gather(
+        *(subscribe(user_id, codes(i)) for i in range(RACE_CALLS)),
+        return_exceptions=True,
+    )
+    errors = sum(isinstance(r, Exception) for r in results)
+    docs = await db.subscriptions.count_documents({"user_id": user_id})
+    return docs, errors
+
+async def main(num_users):
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    suffix = uuid.uuid4().hex[:8]
+    legacy_db = client[f"bench_subscriptions_legacy_{suffix}"]
+    db = client[f"bench_subscriptions_{suffix}"]
+    manager = WebPushManager(db)
+    await manager.ensure_indexes()
+    users = [str(uuid.uuid4()) for _ in range(num_users)]
+
+    try:
+        print(f"Usuarios: {num_users}\n")
+
+        # Creación y actualización individual
+        await timed("legacy subscribe (insert)", lambda i: legacy_subscribe_to_countries(legacy_db, users[i], codes(i)), num_users)
+        await timed("legacy subscribe (update)", lambda i: legacy_subscribe_to_countries(legacy_db, users[i], codes(i + 1)), num_users)
+        await timed("atomic subscribe (insert)", lambda i: manager.subscribe_to_countries(users[i], codes(i)), num_users)
+        await timed("atomic subscribe (update)", lambda i: manager.subscribe_to_countries(users[i], codes(i + 1)), num_users)
+
+        # Toggle de un país en el mapa
+        await timed("add_countries (toggle on)", lambda i: manager.add_countries(users[i], ['JPN']), num_users)
+        await timed("remove_countries (toggle off)", lambda i: manager.remove_countries(users[i], ['JPN']), num_users)
+
+        # Migración masiva: bucle secuencial anterior vs un único bulk_write
+        await legacy_db.subscriptions.delete_many({})
+        await db.subscriptions.delete_many({})
+        mapping = {user_id: codes(i) for i, user_id in enumerate(users)}
+
+        async def legacy_migration(_):
+            for user_id, country_codes in mapping.items():
+                await legacy_subscribe_to_countries(legacy_db, user_id, country_codes)
+
+        await timed("legacy sequential loop (migration)", legacy_migration, 1)
+        await timed("bulk_subscribe (migration)", lambda _: manager.bulk_subscribe(mapping), 1)
+
+        # Carrera: llamadas concurrentes para un mismo usuario
+        legacy_docs, legacy_errors = await count_race_duplicates(
+            lambda user_id, country_codes: legacy_subscribe_to_countries(legacy_db, user_id, country_codes),
+            legacy_db,
+        )
+        atomic_docs, atomic_errors = await count_race_duplicates(manager.subscribe_to_countries, db)
+        print(f"\n{RACE_CALLS} llamadas concurrentes para un mismo usuario:")
+        print(f"  legacy: {legacy_docs} suscripciones ({legacy_errors} errores)")
+        print(f"  atomic: {atomic_docs} suscripciones ({atomic_errors} errores)")
+    finally:
+        await client.drop_database(legacy_db.name)
+        await client.drop_database(db.name)
+        client.close()
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000))
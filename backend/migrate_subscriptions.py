@@ -0,0 +1,29 @@
+"""Migración única: eliminar suscripciones duplicadas y crear el índice único de user_id
+
+Uso: python migrate_subscriptions.py
+Ejecutar una sola vez antes de desplegar la versión con upsert atómico.
+Usa MONGO_URL y DB_NAME del .env.
+"""
+import asyncio
+import os
+from pathlib import Path
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from notifications import WebPushManager
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+async def main():
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    manager = WebPushManager(client[os.environ['DB_NAME']])
+    try:
+        removed = await manager.dedupe_subscriptions()
+        print(f"Suscripciones duplicadas eliminadas: {removed}")
+        await manager.ensure_indexes()
+        print("Índice único de user_id creado")
+    finally:
+        client.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
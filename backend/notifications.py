@@ -4,6 +4,7 @@ import logging
 from typing import List, Dict, Any
 from datetime import datetime, timezone
 from pydantic import BaseModel, Field
+from pymongo import ReturnDocument, UpdateOne
 import uuid
 
 logger = logging.getLogger(__name__)
@@ -57,28 +58,102 @@ class WebPushManager:
         await self.db.push_tokens.insert_one(doc)
         return push_token
     
+    async def ensure_indexes(self):
+        """Crear índices necesarios (una suscripción por usuario)"""
+        await self.db.subscriptions.create_index("user_id", unique=True)
+    
+    async def dedupe_subscriptions(self):
+        """Eliminar suscripciones duplicadas de un mismo usuario
+
+        La implementación anterior (find_one + insert_one) podía crear varias
+        suscripciones por usuario, pero todas las ediciones iban a la primera
+        insertada; las demás guardan listas de países obsoletas. Se conserva
+        la primera sin modificarla y se eliminan las demás. Es una migración
+        única: ver migrate_subscriptions.py.
+        """
+        pipeline = [
+            {"$sort": {"_id": 1}},
+            {"$group": {"_id": "$user_id", "ids": {"$push": "$_id"}, "count": {"$sum": 1}}},
+            {"$match": {"count": {"$gt": 1}}},
+        ]
+        removed = 0
+        async for group in self.db.subscriptions.aggregate(pipeline, allowDiskUse=True):
+            result = await self.db.subscriptions.delete_many({"_id": {"$in": group['ids'][1:]}})
+            removed += result.deleted_count
+        return removed
+    
     async def subscribe_to_countries(self, user_id: str, country_codes: List[str]):
-        """Suscribir usuario a países específicos"""
-        existing = await self.db.subscriptions.find_one({"user_id": user_id}, {"_id": 0})
-        
-        if existing:
-            # Actualizar suscripción existente
-            await self.db.subscriptions.update_one(
+        """Suscribir usuario a países específicos (upsert atómico en un solo viaje)"""
+        subscription = Subscription(user_id=user_id, country_codes=country_codes)
+        doc = await self.db.subscriptions.find_one_and_update(
+            {"user_id": user_id},
+            {
+                "$set": {"country_codes": country_codes},
+                "$setOnInsert": self._insert_fields(subscription),
+            },
+            projection={"_id": 0},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        return Subscription(**doc)
+    
+    async def add_countries(self, user_id: str, country_codes: List[str]):
+        """Agregar países a la suscripción sin reescribir la lista completa"""
+        subscription = Subscription(user_id=user_id, country_codes=[])
+        doc = await self.db.subscriptions.find_one_and_update(
+            {"user_id": user_id},
+            {
+                "$addToSet": {"country_codes": {"$each": list(dict.fromkeys(country_codes))}},
+                "$setOnInsert": self._insert_fields(subscription),
+            },
+            projection={"_id": 0},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        return Subscription(**doc)
+    
+    async def remove_countries(self, user_id: str, country_codes: List[str]):
+        """Quitar países de la suscripción"""
+        doc = await self.db.subscriptions.find_one_and_update(
+            {"user_id": user_id},
+            {"$pull": {"country_codes": {"$in": country_codes}}},
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER,
+        )
+        if doc:
+            return Subscription(**doc)
+        return None
+    
+    async def bulk_subscribe(self, subscriptions: Dict[str, List[str]]):
+        """Suscribir muchos usuarios a la vez ({user_id: country_codes}) en un solo bulk_write"""
+        if not subscriptions:
+            return {"matched": 0, "modified": 0, "upserted": 0}
+        operations = [
+            UpdateOne(
                 {"user_id": user_id},
-                {"$set": {"country_codes": country_codes}}
-            )
-            existing['country_codes'] = country_codes
-            return Subscription(**existing)
-        else:
-            # Crear nueva suscripción
-            subscription = Subscription(
-                user_id=user_id,
-                country_codes=country_codes
+                {
+                    "$set": {"country_codes": country_codes},
+                    "$setOnInsert": self._insert_fields(
+                        Subscription(user_id=user_id, country_codes=country_codes)
+                    ),
+                },
+                upsert=True,
             )
-            doc = subscription.model_dump()
-            doc['created_at'] = doc['created_at'].isoformat()
-            await self.db.subscriptions.insert_one(doc)
-            return subscription
+            for user_id, country_codes in subscriptions.items()
+        ]
+        result = await self.db.subscriptions.bulk_write(operations, ordered=False)
+        return {
+            "matched": result.matched_count,
+            "modified": result.modified_count,
+            "upserted": result.upserted_count,
+        }
+    
+    @staticmethod
+    def _insert_fields(subscription: Subscription) -> Dict[str, Any]:
+        """Campos que solo se escriben al crear la suscripción"""
+        doc = subscription.model_dump(exclude={"user_id", "country_codes"})
+        doc['created_at'] = doc['created_at'].isoformat()
+        return doc
     
     async def get_user_subscriptions(self, user_id: str):
         """Obtener suscripciones de usuario"""
@@ -0,0 +1,222 @@
+"""Control de admisión y limitación de tasa por cliente"""
+import math
+import time
+import logging
+from typing import Callable, Dict, List, Optional, Tuple
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.middleware.base import BaseHTTPMiddleware
+
+logger = logging.getLogger(__name__)
+
+WRITE_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+AUTH_PATH = "/api/auth/login"
+
+class TokenBucket:
+    """Cubo de tokens: `rate` tokens por segundo con ráfaga máxima `burst`"""
+
+    __slots__ = ("rate", "burst", "tokens", "updated_at")
+
+    def __init__(self, rate: float, burst: float, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = now
+
+    def refill(self, now: float):
+        elapsed = now - self.updated_at
+        if elapsed > 0:
+            self.tokens = min(self.burst, self.tokens + elapsed * self.rate)
+            self.updated_at = now
+
+    def wait_time(self) -> float:
+        """Segundos hasta disponer de un token (0 si ya hay uno)"""
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def try_acquire(self, now: float) -> float:
+        """Consumir un token; devuelve 0 si se admite o los segundos a esperar"""
+        self.refill(now)
+        wait = self.wait_time()
+        if not wait:
+            self.tokens -= 1
+        return wait
+
+class RateLimiter:
+    """Presupuestos de tokens por clase de ruta y por clave (IP o usuario)"""
+
+    def __init__(self, budgets: Dict[str, Tuple[float, float]], max_keys: int = 10000):
+        # budgets: {"read": (rate, burst), "write": (...), "auth": (...)}
+        self.budgets = budgets
+        self.max_keys = max_keys
+        self.buckets: Dict[Tuple[str, str], TokenBucket] = {}
+
+    def check(self, route_class: str, key: str, now: Optional[float] = None) -> float:
+        """Devuelve 0 si la petición se admite o el Retry-After en segundos"""
+        return self.acquire(route_class, [key], now)
+
+    def acquire(self, route_class: str, keys: List[str], now: Optional[float] = None) -> float:
+        """Consumir un token de cada clave solo si todas lo tienen disponible
+
+        Una petición rechazada no gasta tokens de ningún cubo, así un usuario
+        limitado no agota el presupuesto de su IP (p. ej. detrás de un NAT).
+        """
+        now = time.monotonic() if now is None else now
+        if len(self.buckets) + len(keys) > self.max_keys:
+            self._prune(now)
+        buckets = [self._bucket(route_class, key, now) for key in keys]
+        wait = 0.0
+        for bucket in buckets:
+            bucket.refill(now)
+            wait = max(wait, bucket.wait_time())
+        if wait:
+            return wait
+        for bucket in buckets:
+            bucket.tokens -= 1
+        return 0.0
+
+    def peek(self, route_class: str, key: str, now: Optional[float] = None) -> float:
+        """Como `check` pero sin consumir tokens"""
+        bucket = self.buckets.get((route_class, key))
+        if bucket is None:
+            return 0.0
+        bucket.refill(time.monotonic() if now is None else now)
+        return bucket.wait_time()
+
+    def _bucket(self, route_class: str, key: str, now: float) -> TokenBucket:
+        bucket = self.buckets.get((route_class, key))
+        if bucket is None:
+            rate, burst = self.budgets[route_class]
+            bucket = TokenBucket(rate, burst, now)
+            self.buckets[(route_class, key)] = bucket
+        return bucket
+
+    def _prune(self, now: float):
+        """Reducir el mapa de cubos a la mitad de `max_keys` para acotar la memoria
+
+        Primero se eliminan los cubos llenos (inactivos) y, si no basta, los
+        más antiguos. Bajar siempre hasta la mitad evita repetir este recorrido
+        O(n) en cada petición que crea una clave nueva.
+        """
+        low_water = self.max_keys // 2
+        idle = [
+            k for k, b in self.buckets.items()
+            if b.tokens + (now - b.updated_at) * b.rate >= b.burst
+        ]
+        for k in idle:
+            del self.buckets[k]
+        if len(self.buckets) > low_water:
+            oldest = sorted(self.buckets, key=lambda k: self.buckets[k].updated_at)
+            for k in oldest[:len(oldest) - low_water]:
+                del self.buckets[k]
+
+class AdmissionStats:
+    """Contadores de peticiones admitidas y rechazadas"""
+
+    def __init__(self):
+        self.admitted = 0
+        self.shed = 0
+        self.rate_limited: Dict[str, int] = {"read": 0, "write": 0, "auth": 0}
+        self.in_flight = 0
+        self.max_in_flight_seen = 0
+
+    def snapshot(self) -> Dict:
+        return {
+            "admitted": self.admitted,
+            "shed": self.shed,
+            "rate_limited": dict(self.rate_limited),
+            "rate_limited_total": sum(self.rate_limited.values()),
+            "in_flight": self.in_flight,
+            "max_in_flight_seen": self.max_in_flight_seen,
+        }
+
+def retry_after_header(seconds: float) -> str:
+    """Valor de la cabecera Retry-After (segundos enteros, mínimo 1)"""
+    return str(max(1, math.ceil(seconds)))
+
+def classify_route(method: str, path: str) -> str:
+    """Clasificar la petición en 'auth', 'write' o 'read'
+
+    Solo el login (bcrypt + Mongo) usa el presupuesto 'auth'; /auth/verify
+    solo decodifica el JWT y el frontend lo llama en cada carga de página.
+    """
+    if method == "POST" and path == AUTH_PATH:
+        return "auth"
+    if method in WRITE_METHODS:
+        return "write"
+    return "read"
+
+def client_ip(request: Request, trust_proxy: bool = False) -> str:
+    """IP del cliente, usando X-Forwarded-For solo si se confía en el proxy"""
+    if trust_proxy:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
+
+class AdmissionControlMiddleware(BaseHTTPMiddleware):
+    """Limita peticiones concurrentes y aplica rate limiting por IP y por usuario
+
+    - Si hay `max_in_flight` peticiones en curso responde 503 inmediatamente.
+    - Si se agota el presupuesto de la IP o del usuario responde 429.
+    Ambas respuestas incluyen la cabecera Retry-After.
+    """
+
+    def __init__(
+        self,
+        app,
+        limiter: RateLimiter,
+        stats: AdmissionStats,
+        max_in_flight: int = 200,
+        user_key: Optional[Callable[[Request], Optional[str]]] = None,
+        path_prefix: str = "/api",
+        trust_proxy: bool = False,
+        shed_retry_after: int = 1,
+    ):
+        super().__init__(app)
+        self.limiter = limiter
+        self.stats = stats
+        self.max_in_flight = max_in_flight
+        self.user_key = user_key
+        self.path_prefix = path_prefix
+        self.trust_proxy = trust_proxy
+        self.shed_retry_after = shed_retry_after
+
+    async def dispatch(self, request: Request, call_next):
+        path = request.url.path
+        if request.method == "OPTIONS" or not path.startswith(self.path_prefix):
+            return await call_next(request)
+
+        stats = self.stats
+        if stats.in_flight >= self.max_in_flight:
+            stats.shed += 1
+            return self._reject(503, "Server overloaded, retry later", self.shed_retry_after)
+
+        route_class = classify_route(request.method, path)
+        keys = ["ip:" + client_ip(request, self.trust_proxy)]
+        if self.user_key is not None:
+            user = self.user_key(request)
+            if user:
+                keys.append("user:" + user)
+        retry_after = self.limiter.acquire(route_class, keys)
+        if retry_after:
+            stats.rate_limited[route_class] += 1
+            return self._reject(429, "Too many requests", retry_after)
+
+        stats.admitted += 1
+        stats.in_flight += 1
+        if stats.in_flight > stats.max_in_flight_seen:
+            stats.max_in_flight_seen = stats.in_flight
+        try:
+            return await call_next(request)
+        finally:
+            stats.in_flight -= 1
+
+    @staticmethod
+    def _reject(status_code: int, detail: str, retry_after: float):
+        return JSONResponse(
+            status_code=status_code,
+            content={"detail": detail},
+            headers={"Retry-After": retry_after_header(retry_after)},
+        )
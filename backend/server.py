@@ -1,4 +1,4 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Request, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
@@ -13,6 +13,7 @@ from datetime import datetime, timezone, timedelta
 import jwt
 from passlib.context import CryptContext
 from notifications import WebPushManager, Subscription, Notification
+from rate_limit import AdmissionControlMiddleware, AdmissionStats, RateLimiter, client_ip, retry_after_header
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -34,6 +35,15 @@ security = HTTPBearer()
 # Inicializar gestor de notificaciones
 push_manager = WebPushManager(db)
 
+# Control de admisión: presupuestos (tokens/segundo, ráfaga) por clase de ruta
+rate_limiter = RateLimiter({
+    "read": (float(os.environ.get('RATE_LIMIT_READ_RATE', '20')), float(os.environ.get('RATE_LIMIT_READ_BURST', '40'))),
+    "write": (float(os.environ.get('RATE_LIMIT_WRITE_RATE', '2')), float(os.environ.get('RATE_LIMIT_WRITE_BURST', '10'))),
+    "auth": (float(os.environ.get('RATE_LIMIT_AUTH_RATE', '0.2')), float(os.environ.get('RATE_LIMIT_AUTH_BURST', '5'))),
+})
+admission_stats = AdmissionStats()
+RATE_LIMIT_TRUST_PROXY = os.environ.get('RATE_LIMIT_TRUST_PROXY', 'false').lower() == 'true'
+
 class User(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -78,7 +88,11 @@ def create_access_token(data: dict):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
+def verify_token(request: Request, credentials: HTTPAuthorizationCredentials = Depends(security)):
+    # El middleware de admisión ya validó el token de esta petición
+    username = getattr(request.state, "username", None)
+    if username is not None:
+        return username
     try:
         token = credentials.credentials
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
@@ -91,8 +105,38 @@ def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
+def rate_limit_user_key(request: Request) -> Optional[str]:
+    """Usuario del token Bearer (si es válido) para el rate limiting por usuario"""
+    auth = request.headers.get("authorization", "")
+    if not auth.lower().startswith("bearer "):
+        return None
+    try:
+        payload = jwt.decode(auth[7:], SECRET_KEY, algorithms=[ALGORITHM])
+    except jwt.InvalidTokenError:
+        return None
+    # Guardar el usuario para que verify_token no vuelva a decodificar el token
+    request.state.username = payload.get("sub")
+    return request.state.username
+
+def login_failed(login_key: str):
+    """Registrar un intento fallido en el cubo de la cuenta y rechazar el login"""
+    rate_limiter.check("auth", login_key)
+    raise HTTPException(status_code=401, detail="Invalid credentials")
+
 @api_router.post("/auth/login", response_model=Token)
-async def login(user_login: UserLogin):
+async def login(user_login: UserLogin, request: Request):
+    # Limitar intentos fallidos por cuenta e IP: solo los fallos gastan tokens,
+    # así un atacante no puede bloquear el login legítimo desde otra IP
+    login_key = f"login:{user_login.username}:{client_ip(request, RATE_LIMIT_TRUST_PROXY)}"
+    retry_after = rate_limiter.peek("auth", login_key)
+    if retry_after:
+        admission_stats.rate_limited["auth"] += 1
+        raise HTTPException(
+            status_code=429,
+            detail="Too many login attempts",
+            headers={"Retry-After": retry_after_header(retry_after)},
+        )
+    
     user = await db.users.find_one({"username": user_login.username}, {"_id": 0})
     
     if not user:
@@ -105,10 +149,10 @@ async def login(user_login: UserLogin):
             await db.users.insert_one(doc)
             access_token = create_access_token(data={"sub": user_login.username})
             return {"access_token": access_token, "token_type": "bearer"}
-        raise HTTPException(status_code=401, detail="Invalid credentials")
+        login_failed(login_key)
     
     if not pwd_context.verify(user_login.password, user['password_hash']):
-        raise HTTPException(status_code=401, detail="Invalid credentials")
+        login_failed(login_key)
     
     access_token = create_access_token(data={"sub": user_login.username})
     return {"access_token": access_token, "token_type": "bearer"}
@@ -188,6 +232,22 @@ async def subscribe_to_countries(request: SubscriptionRequest, username: str = D
     subscription = await push_manager.subscribe_to_countries(user['id'], request.country_codes)
     return subscription
 
+@api_router.post("/notifications/subscribe/add", response_model=Subscription)
+async def add_subscription_countries(request: SubscriptionRequest, username: str = Depends(verify_token)):
+    """Agregar países a la suscripción (p. ej. al activar un país en el mapa)"""
+    user = await db.users.find_one({"username": username}, {"_id": 0})
+    subscription = await push_manager.add_countries(user['id'], request.country_codes)
+    return subscription
+
+@api_router.post("/notifications/subscribe/remove", response_model=Subscription)
+async def remove_subscription_countries(request: SubscriptionRequest, username: str = Depends(verify_token)):
+    """Quitar países de la suscripción"""
+    user = await db.users.find_one({"username": username}, {"_id": 0})
+    subscription = await push_manager.remove_countries(user['id'], request.country_codes)
+    if not subscription:
+        raise HTTPException(status_code=404, detail="Subscription not found")
+    return subscription
+
 @api_router.get("/notifications/subscription")
 async def get_user_subscription(username: str = Depends(verify_token)):
     """Obtener suscripciones del usuario"""
@@ -217,8 +277,22 @@ async def get_unread_count(username: str = Depends(verify_token)):
     count = await db.notifications.count_documents({"user_id": user['id'], "read": False})
     return {"count": count}
 
+@api_router.get("/metrics/admission")
+async def get_admission_metrics(username: str = Depends(verify_token)):
+    """Contadores de peticiones admitidas, rechazadas (429) y descartadas (503)"""
+    return admission_stats.snapshot()
+
 app.include_router(api_router)
 
+app.add_middleware(
+    AdmissionControlMiddleware,
+    limiter=rate_limiter,
+    stats=admission_stats,
+    max_in_flight=int(os.environ.get('MAX_IN_FLIGHT_REQUESTS', '200')),
+    user_key=rate_limit_user_key,
+    trust_proxy=RATE_LIMIT_TRUST_PROXY,
+)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -233,6 +307,15 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def create_indexes():
+    try:
+        await push_manager.ensure_indexes()
+    except Exception as e:
+        # Sin el índice único pueden volver a crearse suscripciones duplicadas;
+        # si ya existen, ejecutar migrate_subscriptions.py
+        logger.error(f"No se pudieron crear los índices de suscripciones: {e}")
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
     client.close()
\ No newline at end of file
@@ -0,0 +1,11 @@
+import os
+import sys
+from pathlib import Path
+
+# Los módulos del backend se importan como módulos de nivel superior
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+# server.py lee la configuración al importarse; Mongo se sustituye en los tests
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "test")
+os.environ["RATE_LIMIT_TRUST_PROXY"] = "true"
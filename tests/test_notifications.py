@@ -0,0 +1,137 @@
+import asyncio
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+from notifications import WebPushManager
+
+
+@pytest.fixture
+def manager():
+    return WebPushManager(AsyncMongoMockClient()["test"])
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_subscribe_upsert_creates_and_keeps_identity(manager):
+    async def scenario():
+        first = await manager.subscribe_to_countries("u1", ["ESP"])
+        second = await manager.subscribe_to_countries("u1", ["USA", "GBR"])
+        docs = await manager.db.subscriptions.find({"user_id": "u1"}).to_list(10)
+        return first, second, docs
+
+    first, second, docs = run(scenario())
+    assert first.id and first.created_at
+    assert first.country_codes == ["ESP"]
+    assert second.id == first.id
+    assert second.created_at == first.created_at
+    assert second.country_codes == ["USA", "GBR"]
+    assert len(docs) == 1
+    assert isinstance(docs[0]["created_at"], str)
+
+
+def test_add_countries_deduplicates(manager):
+    async def scenario():
+        await manager.add_countries("u1", ["ESP", "USA"])
+        return await manager.add_countries("u1", ["USA", "FRA", "FRA"])
+
+    subscription = run(scenario())
+    assert subscription.country_codes == ["ESP", "USA", "FRA"]
+    assert subscription.notify_new_newspapers is True
+
+
+def test_add_countries_creates_subscription(manager):
+    subscription = run(manager.add_countries("u1", ["ESP"]))
+    assert subscription.user_id == "u1"
+    assert subscription.country_codes == ["ESP"]
+    assert subscription.id
+
+
+def test_remove_countries(manager):
+    async def scenario():
+        await manager.subscribe_to_countries("u1", ["ESP", "USA", "FRA"])
+        return await manager.remove_countries("u1", ["USA", "JPN"])
+
+    assert run(scenario()).country_codes == ["ESP", "FRA"]
+
+
+def test_remove_countries_missing_user_returns_none(manager):
+    async def scenario():
+        result = await manager.remove_countries("ghost", ["ESP"])
+        count = await manager.db.subscriptions.count_documents({})
+        return result, count
+
+    assert run(scenario()) == (None, 0)
+
+
+def test_bulk_subscribe_empty(manager):
+    assert run(manager.bulk_subscribe({})) == {"matched": 0, "modified": 0, "upserted": 0}
+
+
+def test_bulk_subscribe_mixed_new_and_existing(manager):
+    async def scenario():
+        existing = await manager.subscribe_to_countries("u1", ["ESP"])
+        await manager.subscribe_to_countries("u2", ["USA"])
+        result = await manager.bulk_subscribe({
+            "u1": ["ESP", "FRA"],  # cambia
+            "u2": ["USA"],         # sin cambios
+            "u3": ["GBR"],         # nuevo
+        })
+        u1 = await manager.get_user_subscriptions("u1")
+        u3 = await manager.get_user_subscriptions("u3")
+        return existing, result, u1, u3
+
+    existing, result, u1, u3 = run(scenario())
+    assert result == {"matched": 2, "modified": 1, "upserted": 1}
+    assert u1.id == existing.id
+    assert u1.country_codes == ["ESP", "FRA"]
+    assert u3.country_codes == ["GBR"] and u3.id
+
+
+def test_dedupe_keeps_first_subscription_unchanged(manager):
+    async def scenario():
+        # "a" recibió las ediciones (el usuario quitó USA); "b" quedó obsoleta
+        await manager.db.subscriptions.insert_many([
+            {"id": "a", "user_id": "u1", "country_codes": ["ESP"],
+             "notify_new_newspapers": True, "created_at": "2024-01-01T00:00:00+00:00"},
+            {"id": "b", "user_id": "u1", "country_codes": ["ESP", "USA"],
+             "notify_new_newspapers": True, "created_at": "2024-01-01T00:00:00+00:00"},
+            {"id": "c", "user_id": "u2", "country_codes": ["GBR"],
+             "notify_new_newspapers": True, "created_at": "2024-01-01T00:00:00+00:00"},
+        ])
+        removed = await manager.dedupe_subscriptions()
+        await manager.ensure_indexes()
+        docs = await manager.db.subscriptions.find({}, {"_id": 0}).sort("user_id", 1).to_list(10)
+        return removed, docs
+
+    removed, docs = run(scenario())
+    assert removed == 1
+    assert [(d["id"], d["country_codes"]) for d in docs] == [("a", ["ESP"]), ("c", ["GBR"])]
+
+
+def test_ensure_indexes_does_not_dedupe(manager):
+    from pymongo.errors import OperationFailure
+
+    async def scenario():
+        await manager.db.subscriptions.insert_many([
+            {"id": "a", "user_id": "u1", "country_codes": []},
+            {"id": "b", "user_id": "u1", "country_codes": []},
+        ])
+        await manager.ensure_indexes()
+
+    with pytest.raises(OperationFailure):
+        run(scenario())
+
+
+def test_unique_index_rejects_duplicate_user(manager):
+    from pymongo.errors import DuplicateKeyError
+
+    async def scenario():
+        await manager.ensure_indexes()
+        await manager.subscribe_to_countries("u1", ["ESP"])
+        await manager.db.subscriptions.insert_one({"user_id": "u1", "country_codes": []})
+
+    with pytest.raises(DuplicateKeyError):
+        run(scenario())
@@ -0,0 +1,182 @@
+import pytest
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import PlainTextResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from rate_limit import (
+    AdmissionControlMiddleware,
+    AdmissionStats,
+    RateLimiter,
+    TokenBucket,
+    classify_route,
+    client_ip,
+    retry_after_header,
+)
+
+
+def make_request(headers=None, client=("10.0.0.1", 1234)):
+    scope = {
+        "type": "http",
+        "method": "GET",
+        "path": "/api/newspapers",
+        "headers": [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()],
+        "client": client,
+    }
+    return Request(scope)
+
+
+def make_client(limiter, stats, max_in_flight=10, user_key=None):
+    async def ok(request):
+        return PlainTextResponse("ok")
+
+    app = Starlette(routes=[
+        Route("/api/newspapers", ok),
+        Route("/api/auth/login", ok, methods=["POST"]),
+        Route("/health", ok),
+    ])
+    app.add_middleware(
+        AdmissionControlMiddleware,
+        limiter=limiter,
+        stats=stats,
+        max_in_flight=max_in_flight,
+        user_key=user_key,
+    )
+    return TestClient(app)
+
+
+def test_bucket_burst_then_refill():
+    bucket = TokenBucket(rate=1, burst=3, now=0)
+    assert [bucket.try_acquire(0) for _ in range(3)] == [0, 0, 0]
+    assert bucket.try_acquire(0) > 0
+    assert bucket.try_acquire(1) == 0
+    assert bucket.try_acquire(1) > 0
+
+
+def test_bucket_refill_is_capped_at_burst():
+    bucket = TokenBucket(rate=1, burst=2, now=0)
+    bucket.refill(100)
+    assert bucket.tokens == 2
+
+
+def test_retry_after_value():
+    limiter = RateLimiter({"auth": (0.2, 2)})
+    assert limiter.check("auth", "a", now=0) == 0
+    assert limiter.check("auth", "a", now=0) == 0
+    assert limiter.check("auth", "a", now=0) == pytest.approx(5)
+    assert limiter.check("auth", "a", now=2.5) == pytest.approx(2.5)
+    assert retry_after_header(2.5) == "3"
+    assert retry_after_header(0.01) == "1"
+
+
+def test_rejected_request_does_not_consume_tokens():
+    limiter = RateLimiter({"read": (1, 2)})
+    assert limiter.acquire("read", ["ip:1", "user:u"], now=0) == 0
+    assert limiter.acquire("read", ["ip:1", "user:u"], now=0) == 0
+    # El usuario está agotado; la IP compartida no debe pagar el rechazo
+    assert limiter.acquire("read", ["ip:2", "user:u"], now=0) > 0
+    assert limiter.buckets[("read", "ip:2")].tokens == 2
+    assert limiter.acquire("read", ["ip:2"], now=0) == 0
+
+
+def test_buckets_are_per_route_class():
+    limiter = RateLimiter({"read": (1, 1), "write": (1, 1)})
+    assert limiter.check("read", "ip:1", now=0) == 0
+    assert limiter.check("write", "ip:1", now=0) == 0
+    assert limiter.check("read", "ip:1", now=0) > 0
+
+
+def test_prune_drops_idle_buckets_at_max_keys():
+    limiter = RateLimiter({"read": (1, 2)}, max_keys=4)
+    for i in range(4):
+        limiter.check("read", str(i), now=0)
+    # Todos los cubos se rellenan antes de t=10: se consideran inactivos
+    limiter.check("read", "new", now=10)
+    assert list(limiter.buckets) == [("read", "new")]
+
+
+def test_prune_drops_oldest_when_all_active():
+    limiter = RateLimiter({"read": (0.001, 5)}, max_keys=4)
+    for i in range(4):
+        limiter.check("read", str(i), now=i)
+    limiter.check("read", "new", now=4)
+    assert len(limiter.buckets) <= 4
+    assert ("read", "0") not in limiter.buckets
+    assert ("read", "new") in limiter.buckets
+
+
+def test_prune_shrinks_to_low_water_mark():
+    limiter = RateLimiter({"read": (0.001, 5)}, max_keys=10)
+    for i in range(10):
+        limiter.check("read", str(i), now=i)
+    limiter.check("read", "new", now=10)
+    assert len(limiter.buckets) == 6
+    # Las siguientes claves nuevas no vuelven a podar hasta llegar a max_keys
+    for i in range(4):
+        limiter.check("read", f"more{i}", now=11 + i)
+    assert len(limiter.buckets) == 10
+    assert ("read", "new") in limiter.buckets
+
+
+def test_peek_does_not_consume():
+    limiter = RateLimiter({"auth": (1, 1)})
+    assert limiter.peek("auth", "k", now=0) == 0
+    assert limiter.check("auth", "k", now=0) == 0
+    assert limiter.peek("auth", "k", now=0) == pytest.approx(1)
+    assert limiter.peek("auth", "k", now=1) == 0
+    assert limiter.check("auth", "k", now=1) == 0
+
+
+def test_classify_route():
+    assert classify_route("POST", "/api/auth/login") == "auth"
+    assert classify_route("GET", "/api/auth/login") == "read"
+    assert classify_route("GET", "/api/auth/verify") == "read"
+    assert classify_route("POST", "/api/newspapers") == "write"
+    assert classify_route("DELETE", "/api/newspapers/1") == "write"
+    assert classify_route("GET", "/api/newspapers") == "read"
+
+
+def test_client_ip_ignores_forwarded_for_unless_trusted():
+    request = make_request({"X-Forwarded-For": "1.2.3.4, 10.0.0.2"})
+    assert client_ip(request) == "10.0.0.1"
+    assert client_ip(request, trust_proxy=True) == "1.2.3.4"
+    assert client_ip(make_request(), trust_proxy=True) == "10.0.0.1"
+
+
+def test_middleware_returns_429_with_retry_after():
+    stats = AdmissionStats()
+    client = make_client(RateLimiter({"read": (0.5, 1), "write": (1, 1), "auth": (1, 1)}), stats)
+    assert client.get("/api/newspapers").status_code == 200
+    response = client.get("/api/newspapers")
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "2"
+    assert stats.rate_limited["read"] == 1
+    assert stats.admitted == 1
+
+
+def test_middleware_keys_on_user():
+    stats = AdmissionStats()
+    limiter = RateLimiter({"read": (1, 1), "write": (1, 1), "auth": (1, 1)})
+    client = make_client(limiter, stats, user_key=lambda request: request.headers.get("x-user"))
+    assert client.get("/api/newspapers", headers={"x-user": "ana"}).status_code == 200
+    assert ("read", "user:ana") in limiter.buckets
+
+
+def test_middleware_sheds_load_with_503():
+    stats = AdmissionStats()
+    client = make_client(RateLimiter({"read": (1, 10), "write": (1, 1), "auth": (1, 1)}), stats, max_in_flight=2)
+    stats.in_flight = 2
+    response = client.get("/api/newspapers")
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+    assert stats.shed == 1
+    assert stats.admitted == 0
+
+
+def test_middleware_skips_non_api_paths():
+    stats = AdmissionStats()
+    client = make_client(RateLimiter({"read": (1, 1), "write": (1, 1), "auth": (1, 1)}), stats)
+    stats.in_flight = 100
+    assert client.get("/health").status_code == 200
+    assert stats.shed == 0
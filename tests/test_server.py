@@ -0,0 +1,69 @@
+import pytest
+from fastapi.testclient import TestClient
+from mongomock_motor import AsyncMongoMockClient
+
+import server
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(server, "db", AsyncMongoMockClient()["test"])
+    server.rate_limiter.buckets.clear()
+    return TestClient(server.app)
+
+
+def login(client, username, password, ip):
+    return client.post(
+        "/api/auth/login",
+        json={"username": username, "password": password},
+        headers={"X-Forwarded-For": ip},
+    )
+
+
+def test_verify_is_not_limited_by_auth_budget(client):
+    token = server.create_access_token({"sub": "admin"})
+    statuses = [
+        client.get("/api/auth/verify", headers={"Authorization": f"Bearer {token}"}).status_code
+        for _ in range(10)
+    ]
+    assert statuses == [200] * 10
+
+
+def test_verify_reuses_username_decoded_by_middleware(client, monkeypatch):
+    token = server.create_access_token({"sub": "admin"})
+    decode = server.jwt.decode
+    calls = []
+
+    def counting_decode(*args, **kwargs):
+        calls.append(1)
+        return decode(*args, **kwargs)
+
+    monkeypatch.setattr(server.jwt, "decode", counting_decode)
+    response = client.get("/api/auth/verify", headers={"Authorization": f"Bearer {token}"})
+    assert response.json() == {"username": "admin"}
+    assert len(calls) == 1
+
+
+def test_verify_rejects_invalid_token(client):
+    response = client.get("/api/auth/verify", headers={"Authorization": "Bearer bad"})
+    assert response.status_code == 401
+    assert response.json() == {"detail": "Invalid token"}
+
+
+def test_failed_logins_are_limited_per_account_and_ip(client):
+    assert login(client, "admin", "admin123", "9.9.9.9").status_code == 200
+    assert [login(client, "admin", "wrong", "1.1.1.1").status_code for _ in range(5)] == [401] * 5
+    # Vaciar el cubo por IP del middleware para comprobar el cubo de la cuenta
+    server.rate_limiter.buckets.pop(("auth", "ip:1.1.1.1"))
+    response = login(client, "admin", "admin123", "1.1.1.1")
+    assert response.status_code == 429
+    assert response.json() == {"detail": "Too many login attempts"}
+    assert "Retry-After" in response.headers
+    # El bloqueo no afecta al administrador legítimo desde otra IP
+    assert login(client, "admin", "admin123", "2.2.2.2").status_code == 200
+
+
+def test_successful_logins_do_not_consume_account_budget(client):
+    statuses = [login(client, "admin", "admin123", f"3.3.3.{i}").status_code for i in range(7)]
+    assert statuses == [200] * 7
+    assert not any(key.startswith("login:") for _, key in server.rate_limiter.buckets)